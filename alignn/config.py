@@ -184,6 +184,9 @@ class TrainingConfig(BaseSettings):
     optimizer: Literal["adamw", "sgd"] = "adamw"
     scheduler: Literal["onecycle", "none"] = "onecycle"
     pin_memory: bool = False
+    # reduced-precision features/weights; fp16/bf16 halve feature
+    # memory and H2D traffic but are only worthwhile on GPU targets
+    dtype: Literal["float32", "float16", "bfloat16"] = "float32"
     save_dataloader: bool = False
     write_checkpoint: bool = True
     write_predictions: bool = True
@@ -6,13 +6,16 @@ from typing import Optional
 
 # from typing import Dict, List, Optional, Set, Tuple
 
+import hashlib
+import json
+import multiprocessing as mp
 import os
 import torch
 import dgl
 import numpy as np
 import pandas as pd
 from jarvis.core.atoms import Atoms
-from jarvis.core.graphs import Graph, StructureDataset
+from alignn.graphs import Graph, StructureDataset
 from jarvis.db.figshare import data as jdata
 from torch.utils.data import DataLoader
 from tqdm import tqdm
@@ -66,6 +69,22 @@ def mean_absolute_deviation(data, axis=None):
     return np.mean(np.absolute(data - np.mean(data, axis)), axis)
 
 
+def _build_graph(args):
+    """Build one graph in a worker process (top-level: picklable)."""
+    index, atoms, neighbor_strategy, cutoff, max_neighbors, canonize = args
+    structure = Atoms.from_dict(atoms)
+    g = Graph.atom_dgl_multigraph(
+        structure,
+        neighbor_strategy=neighbor_strategy,
+        cutoff=cutoff,
+        atom_features="atomic_number",
+        max_neighbors=max_neighbors,
+        compute_line_graph=False,
+        use_canonize=canonize,
+    )
+    return index, g
+
+
 def load_graphs(
     df: pd.DataFrame,
     name: str = "dft_3d",
@@ -74,6 +93,7 @@ def load_graphs(
     max_neighbors: int = 12,
     cachedir: Optional[Path] = None,
     use_canonize: bool = False,
+    min_pool_size: int = 512,
 ):
     """Construct crystal graphs.
 
@@ -93,6 +113,7 @@ def load_graphs(
         structure = Atoms.from_dict(atoms)
         return Graph.atom_dgl_multigraph(
             structure,
+            neighbor_strategy=neighbor_strategy,
             cutoff=cutoff,
             atom_features="atomic_number",
             max_neighbors=max_neighbors,
@@ -100,18 +121,75 @@ def load_graphs(
             use_canonize=use_canonize,
         )
 
+    cachefile = None
     if cachedir is not None:
         if not os.path.exists(cachedir):
             os.makedirs(cachedir)
-        cachefile = cachedir + f"{name}-{neighbor_strategy}.bin"
-    else:
-        cachefile = None
+        # content-addressed cache key: the same structures with the
+        # same graph settings always map to the same file, so stale
+        # graphs are never loaded for a different split or cutoff
+        key = hashlib.blake2b(
+            json.dumps(
+                {
+                    "atoms": df["atoms"].tolist(),
+                    "neighbor_strategy": neighbor_strategy,
+                    "cutoff": cutoff,
+                    "max_neighbors": max_neighbors,
+                    "use_canonize": use_canonize,
+                    # cached edata["r"] carries a concrete dtype, so a
+                    # cache built under fp32 must not serve fp16 runs
+                    "dtype": str(torch.get_default_dtype()),
+                },
+                sort_keys=True,
+                default=str,
+            ).encode(),
+            digest_size=16,
+        ).hexdigest()
+        cachefile = os.path.join(
+            str(cachedir), f"{name}-{neighbor_strategy}-{key}.bin"
+        )
 
     if cachefile is not None and os.path.isfile(cachefile):
         graphs, labels = dgl.load_graphs(cachefile)
     else:
-        graphs = df["atoms"].progress_apply(atoms_to_graph).values
-        dgl.save_graphs(cachefile, graphs.tolist())
+        nprocs = min(len(df), os.cpu_count() or 1)
+        if nprocs > 1 and len(df) >= min_pool_size:
+            # graph construction is CPU-bound and independent per
+            # structure, so fan it out over all cores; the index sent
+            # with each work item restores dataframe order. Each
+            # spawned worker re-imports torch/dgl/jarvis, so small
+            # datasets build faster serially than they can pay that
+            # startup cost
+            work = [
+                (
+                    i,
+                    atoms,
+                    neighbor_strategy,
+                    cutoff,
+                    max_neighbors,
+                    use_canonize,
+                )
+                for i, atoms in enumerate(df["atoms"])
+            ]
+            graphs = [None] * len(work)
+            ctx = mp.get_context("spawn")
+            # spawned workers start with torch's float32 default, so
+            # propagate the parent's dtype or half-precision runs get
+            # fp32 edata["r"] baked into (and cached for) every graph
+            with ctx.Pool(
+                nprocs,
+                initializer=torch.set_default_dtype,
+                initargs=(torch.get_default_dtype(),),
+            ) as pool:
+                for i, g in tqdm(
+                    pool.imap_unordered(_build_graph, work, chunksize=8),
+                    total=len(work),
+                ):
+                    graphs[i] = g
+        else:
+            graphs = df["atoms"].progress_apply(atoms_to_graph).values
+        if cachefile is not None:
+            dgl.save_graphs(cachefile, list(graphs))
 
     return graphs
 
@@ -312,7 +390,7 @@ def get_train_val_loaders(
         # TODO:make an all key in qm9_dgl
         if dataset == "qm9_dgl" and target == "all":
             print("Making all qm9_dgl")
-            tmp = []
+            # annotate the rows in place instead of copying `d`
             for ii in d:
                 ii["all"] = [
                     ii["mu"],
@@ -328,9 +406,7 @@ def get_train_val_loaders(
                     ii["G"],
                     ii["Cv"],
                 ]
-                tmp.append(ii)
             print("Made all qm9_dgl")
-            d = tmp
         for i in d:
             if isinstance(i[target], list):  # multioutput target
                 all_targets.append(torch.tensor(i[target]))#.half())
@@ -371,17 +447,19 @@ def get_train_val_loaders(
             n_val=n_val,
             keep_data_order=keep_data_order,
         )
-        ids_train_val_test = {}
-        ids_train_val_test["id_train"] = [dat[i][id_tag] for i in id_train]
-        ids_train_val_test["id_val"] = [dat[i][id_tag] for i in id_val]
-        ids_train_val_test["id_test"] = [dat[i][id_tag] for i in id_test]
+        # select the split rows once; the id lists reuse the same rows
+        dataset_train = [dat[x] for x in id_train]
+        dataset_val = [dat[x] for x in id_val]
+        dataset_test = [dat[x] for x in id_test]
+        ids_train_val_test = {
+            "id_train": [i[id_tag] for i in dataset_train],
+            "id_val": [i[id_tag] for i in dataset_val],
+            "id_test": [i[id_tag] for i in dataset_test],
+        }
         dumpjson(
             data=ids_train_val_test,
             filename=os.path.join(output_dir, "ids_train_val_test.json"),
         )
-        dataset_train = [dat[x] for x in id_train]
-        dataset_val = [dat[x] for x in id_val]
-        dataset_test = [dat[x] for x in id_test]
 
         if standard_scalar_and_pca:
             y_data = [i[target] for i in dataset_train]
@@ -434,10 +512,12 @@ def get_train_val_loaders(
                     print("Cannot write mad", exp)
                     pass
                 # Random model precited value
-                x_bar = np.mean(np.array([i[target] for i in dataset_train]))
+                test_targets = np.array(
+                    [i[target] for i in dataset_test]
+                )
+                x_bar = np.mean([i[target] for i in dataset_train])
                 baseline_mae = mean_absolute_error(
-                    np.array([i[target] for i in dataset_test]),
-                    np.array([x_bar for i in dataset_test]),
+                    test_targets, np.full(len(test_targets), x_bar)
                 )
                 print("Baseline MAE:", baseline_mae)
             except Exception as exp:
@@ -494,6 +574,13 @@ def get_train_val_loaders(
         if line_graph:
             collate_fn = train_data.collate_line_graph
 
+        # keep loader workers alive across epochs and let them batch
+        # ahead, so graph collation overlaps with the device copies of
+        # the batches already in flight
+        loader_kwargs = {}
+        if workers > 0:
+            loader_kwargs = dict(persistent_workers=True, prefetch_factor=4)
+
         # use a regular pytorch dataloader
         train_loader = DataLoader(
             train_data,
@@ -503,6 +590,7 @@ def get_train_val_loaders(
             drop_last=True,
             num_workers=workers,
             pin_memory=pin_memory,
+            **loader_kwargs,
         )
 
         val_loader = DataLoader(
@@ -513,6 +601,7 @@ def get_train_val_loaders(
             drop_last=True,
             num_workers=workers,
             pin_memory=pin_memory,
+            **loader_kwargs,
         )
 
         test_loader = DataLoader(
@@ -523,6 +612,7 @@ def get_train_val_loaders(
             drop_last=False,
             num_workers=workers,
             pin_memory=pin_memory,
+            **loader_kwargs,
         )
         if save_dataloader:
             torch.save(train_loader, train_sample)
@@ -0,0 +1,731 @@
+"""Module to generate DGLGraphs from atomic structures."""
+
+import itertools
+import os
+from collections import defaultdict
+from functools import lru_cache
+from typing import Optional
+
+import dgl
+import numpy as np
+import torch
+from jarvis.core import specie
+from jarvis.core.specie import Specie, chem_data
+from jarvis.db.jsonutils import loadjson
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+from tqdm import tqdm
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def canonize_edge(
+    src_id,
+    dst_id,
+    src_image,
+    dst_image,
+):
+    """Compute canonical edge representation.
+
+    Sort vertex ids
+    shift periodic images so the first vertex is in (0,0,0) image
+    """
+    # store directed edges src_id <= dst_id
+    if dst_id < src_id:
+        src_id, dst_id = dst_id, src_id
+        src_image, dst_image = dst_image, src_image
+
+    # shift periodic images so that src is in (0,0,0) image
+    # plain tuple arithmetic: the operands are 3-tuples of ints, and
+    # np.subtract/np.array_equal cost microseconds per call here
+    if src_image != (0, 0, 0):
+        dst_image = (
+            dst_image[0] - src_image[0],
+            dst_image[1] - src_image[1],
+            dst_image[2] - src_image[2],
+        )
+        src_image = (0, 0, 0)
+
+    return src_id, dst_id, src_image, dst_image
+
+
+def _knn_edge_arrays(src_sites, neighbor_ids, image_ids, shifts, canonize):
+    """Canonicalize flat KNN edge arrays.
+
+    Branch-free equivalent of calling `canonize_edge` per edge;
+    JIT-compiled with numba when available.
+    """
+    n_edges = src_sites.shape[0]
+    src = np.empty(n_edges, dtype=np.int64)
+    dst = np.empty(n_edges, dtype=np.int64)
+    images = np.empty((n_edges, 3), dtype=np.int64)
+    for idx in range(n_edges):
+        s = src_sites[idx]
+        d = neighbor_ids[idx]
+        img = image_ids[idx]
+        ix = shifts[img, 0]
+        iy = shifts[img, 1]
+        iz = shifts[img, 2]
+        if canonize and d < s:
+            # swapping endpoints moves src into the dst image;
+            # shifting src back to (0, 0, 0) negates the image
+            s, d = d, s
+            ix, iy, iz = -ix, -iy, -iz
+        src[idx] = s
+        dst[idx] = d
+        images[idx, 0] = ix
+        images[idx, 1] = iy
+        images[idx, 2] = iz
+    return src, dst, images
+
+
+if njit is not None:
+    _knn_edge_arrays = njit(cache=True)(_knn_edge_arrays)
+
+
+def nearest_neighbor_edges(
+    atoms=None,
+    cutoff=8,
+    max_neighbors=12,
+    id=None,
+    use_canonize=False,
+):
+    """Construct k-NN edge list with a single batched KDTree query.
+
+    Builds a block of periodic images wide enough to cover a sphere
+    of radius `cutoff` around every home-cell site, then finds the k
+    nearest periodic neighbors of every site in one C-level
+    `cKDTree.query` call instead of filtering `get_all_neighbors`
+    output in Python site by site.
+    """
+    frac_coords = np.asarray(atoms.frac_coords)
+    lattice_mat = np.asarray(atoms.lattice_mat)
+    n_sites = len(frac_coords)
+
+    # perpendicular cell heights (spacing between opposite cell
+    # faces) convert a cartesian search radius into the number of
+    # periodic images needed per axis: a flat 3x3x3 block misses true
+    # neighbors of anisotropic cells, e.g. 2D slabs with a vacuum
+    # axis, where in-plane shells need shifts beyond +-1
+    volume = abs(np.linalg.det(lattice_mat))
+    face_normals = np.cross(
+        np.roll(lattice_mat, -1, axis=0), np.roll(lattice_mat, -2, axis=0)
+    )
+    heights = volume / np.linalg.norm(face_normals, axis=1)
+
+    # grow the search radius until the image block provably contains
+    # the k nearest neighbors of every site: the block covers a
+    # sphere of radius search_r around every home-cell site, so the
+    # query is exact once the largest k-th neighbor distance fits
+    # inside it -- the geometric insufficiency the old cutoff-doubling
+    # recursion existed for
+    search_r = cutoff
+    while True:
+        # +1 image of margin covers fractional offsets within the cell
+        reps = np.ceil(search_r / heights).astype(int) + 1
+
+        # periodic image shifts, in lexicographic order
+        # so that index n_shifts // 2 is the (0, 0, 0) image
+        shifts = np.array(
+            list(itertools.product(*(range(-r, r + 1) for r in reps)))
+        )
+        n_shifts = shifts.shape[0]
+
+        # cartesian coordinates of every periodic image:
+        # (n_sites, n_shifts, 3)
+        images = (
+            frac_coords[:, None, :] + shifts[None, :, :]
+        ) @ lattice_mat
+        tree = cKDTree(images.reshape(-1, 3))
+        cart_coords = images[:, n_shifts // 2]
+
+        n_points = n_shifts * n_sites
+        # query k + 1 points (the first match of each site is itself)
+        # plus spare columns so shell ties are usually visible without
+        # a second query: 8 spares cover the 18-neighbor tie shells of
+        # cubic lattices at the default max_neighbors = 12
+        k = min(max_neighbors + 9, n_points)
+        distances, flat_ids = tree.query(cart_coords, k=k, workers=-1)
+
+        if (
+            k > max_neighbors
+            and distances[:, max_neighbors].max() <= search_r
+        ):
+            break
+        search_r = max(2 * search_r, distances[:, -1].max())
+
+    # keep all edges out to the neighbor shell of the k-th neighbor:
+    # rows come back distance-sorted, so one broadcast comparison
+    # against each site's k-th distance thresholds every site at
+    # once; an ulp of tolerance keeps symmetry-equivalent ties that
+    # differ only in float rounding. Re-query with a widened window
+    # only when some site's ties run past the spare columns, so tied
+    # neighbors are never truncated and the common case stays at one
+    # query
+    max_dist = distances[:, [max_neighbors]] * (1 + 1e-8)
+    while k < n_points and np.any(distances[:, -1:] <= max_dist):
+        k = min(2 * k, n_points)
+        distances, flat_ids = tree.query(cart_coords, k=k, workers=-1)
+        max_dist = distances[:, [max_neighbors]] * (1 + 1e-8)
+
+    # (column 0 is the zero-distance self match and drops out)
+    rows, cols = np.nonzero(distances[:, 1:] <= max_dist)
+    flat = flat_ids[:, 1:][rows, cols]
+
+    # recover (site, image) from the flattened supercell index, then
+    # canonicalize every candidate edge in one flat pass (compiled by
+    # numba when available) and deduplicate to the canonical edge set
+    # with a row-wise unique over the (src, dst, image) table
+    src, dst, edge_images = _knn_edge_arrays(
+        np.ascontiguousarray(rows, dtype=np.int64),
+        np.ascontiguousarray(flat // n_shifts, dtype=np.int64),
+        np.ascontiguousarray(flat % n_shifts, dtype=np.int64),
+        np.ascontiguousarray(shifts, dtype=np.int64),
+        use_canonize,
+    )
+    table = np.unique(
+        np.concatenate((src[:, None], dst[:, None], edge_images), axis=1),
+        axis=0,
+    )
+
+    return table[:, 0], table[:, 1], table[:, 2:]
+
+
+def voronoi_edges(
+    atoms=None,
+    cutoff=8,
+    max_neighbors=12,
+    id=None,
+    use_canonize=False,
+):
+    """Construct Voronoi edge list via pymatgen's VoronoiNN.
+
+    `get_all_nn_info` solves the tessellation for every site in a
+    single call instead of site-by-site `get_nn_info` queries;
+    structure-level parallelism comes from the process pool in
+    `alignn.data.load_graphs`. `cutoff` and `max_neighbors` are
+    accepted for interface parity with the other edge builders but
+    the tessellation alone decides connectivity.
+    """
+    # pymatgen is an optional dependency, only needed for this strategy
+    try:
+        from pymatgen.analysis.local_env import VoronoiNN
+    except ImportError as exp:
+        raise ImportError(
+            "neighbor_strategy='voronoi' requires pymatgen", exp
+        )
+
+    structure = atoms.pymatgen_converter()
+    vnn = VoronoiNN(allow_pathological=True)
+    try:
+        all_nn_info = vnn.get_all_nn_info(structure)
+    except (ValueError, RuntimeError) as exp:
+        # the batched tessellation can fail on pathological cells;
+        # fall back to per-site queries so one bad structure does not
+        # abort a whole dataset build
+        print("get_all_nn_info failed, retrying per site", id, exp)
+        all_nn_info = [
+            vnn.get_nn_info(structure, site_idx)
+            for site_idx in range(len(structure))
+        ]
+
+    edges = defaultdict(set)
+    for site_idx, nn_info in enumerate(all_nn_info):
+        for nn in nn_info:
+            dst = nn["site_index"]
+            image = tuple(int(x) for x in nn["image"])
+            src_id, dst_id, src_image, dst_image = canonize_edge(
+                site_idx, dst, (0, 0, 0), image
+            )
+            if use_canonize:
+                edges[(src_id, dst_id)].add(dst_image)
+            else:
+                edges[(site_idx, dst)].add(image)
+
+    return edges
+
+
+def build_undirected_edgedata(
+    atoms=None,
+    edges={},
+):
+    """Build undirected graph data from edge set.
+
+    edges: (src_ids, dst_ids, images) arrays from
+    `nearest_neighbor_edges`, or a dictionary mapping (src_id, dst_id)
+    to a set of dst_image tuples
+    r: cartesian displacement vector from src -> dst
+    """
+    # second pass: construct *undirected* graph
+    # compute all displacement vectors with one matmul
+    if isinstance(edges, dict):
+        # legacy edge dictionary: flatten into arrays first
+        flat = [
+            (src_id, dst_id, dst_image)
+            for (src_id, dst_id), images in edges.items()
+            for dst_image in images
+        ]
+        src_ids = np.array([e[0] for e in flat])
+        dst_ids = np.array([e[1] for e in flat])
+        images = np.array([e[2] for e in flat])
+    else:
+        src_ids, dst_ids, images = edges
+
+    frac_coords = np.asarray(atoms.frac_coords)
+    lattice_mat = np.asarray(atoms.lattice_mat)
+
+    # fractional displacement to the periodic image of dst,
+    # mapped to cartesian space in a single batched product
+    disp_frac = frac_coords[dst_ids] + images - frac_coords[src_ids]
+    d = disp_frac @ lattice_mat
+
+    # add edges for both directions
+    u = torch.from_numpy(np.concatenate((src_ids, dst_ids)))
+    v = torch.from_numpy(np.concatenate((dst_ids, src_ids)))
+    r = torch.from_numpy(np.concatenate((d, -d))).type(
+        torch.get_default_dtype()
+    )
+
+    return u, v, r
+
+
+# CGCNN one-hot encodings shipped with jarvis-tools, loaded once at
+# import time rather than re-parsed from JSON on every lookup
+_cgcnn_feature_json = loadjson(
+    os.path.join(os.path.dirname(specie.__file__), "atom_init.json")
+)
+
+
+@lru_cache(maxsize=512)
+def _get_node_attributes(species, atom_features="atomic_number"):
+    """Get node features for an element by name.
+
+    Bounded per-process cache: every Specie lookup walks the
+    jarvis-tools element tables, and dataloader / pool workers each
+    featurize the same handful of elements thousands of times.
+    """
+    feature_sets = ("atomic_number", "basic", "cfid", "cgcnn")
+
+    if atom_features not in feature_sets:
+        raise NotImplementedError(
+            f"atom features must be one of {feature_sets}"
+        )
+
+    if atom_features == "cfid":
+        return Specie(species).get_descrp_arr
+    elif atom_features == "atomic_number":
+        return [Specie(species).element_property("Z")]
+    elif atom_features == "basic":
+        props = [
+            "Z",
+            "coulmn",
+            "row",
+            "X",
+            "atom_rad",
+            "nsvalence",
+            "npvalence",
+            "ndvalence",
+            "nfvalence",
+            "first_ion_en",
+            "elec_aff",
+        ]
+        return [Specie(species).element_property(prop) for prop in props]
+    elif atom_features == "cgcnn":
+        # elements past Fm (Z=100) have no entry in atom_init.json;
+        # return None so lookup tables leave those rows zeroed
+        # instead of raising KeyError
+        return _cgcnn_feature_json.get(str(Specie(species).Z))
+
+
+# edge construction strategies available to `atom_dgl_multigraph`;
+# every builder shares the (atoms, cutoff, max_neighbors, id,
+# use_canonize) interface, so the strategy is resolved with one
+# dictionary lookup instead of an if-chain per graph
+EDGE_STRATEGIES = {
+    "k-nearest": nearest_neighbor_edges,
+    "voronoi": voronoi_edges,
+}
+
+
+class Graph(object):
+    """Generate a graph object."""
+
+    def __init__(
+        self,
+        nodes=[],
+        node_attributes=[],
+        edges=[],
+        edge_attributes=[],
+        color_map=None,
+        labels=None,
+    ):
+        """
+        Initialize the graph object.
+
+        Args:
+            nodes: IDs of the graph nodes as integer array.
+
+            node_attributes: node features as multi-dimensional array.
+
+            edges: connectivity as a (u,v) pair where u is
+                   the source index and v the destination ID.
+
+            edge_attributes: attributes for each connectivity.
+                             as simple as euclidean distances.
+        """
+        self.nodes = nodes
+        self.node_attributes = node_attributes
+        self.edges = edges
+        self.edge_attributes = edge_attributes
+        self.color_map = color_map
+        self.labels = labels
+
+    @classmethod
+    def from_atoms(
+        cls,
+        atoms=None,
+        get_prim=False,
+        zero_diag=False,
+        features="basic",
+        enforce_c_size=10.0,
+        max_cut=5.0,
+    ):
+        """Get adjacency-matrix graph for Atoms object.
+
+        Args:
+            atoms: jarvis.core.atoms.Atoms object.
+
+            features: node feature set, see `_get_node_attributes`.
+
+            enforce_c_size: minimum supercell dimension (angstrom).
+
+            max_cut: cut-off after which distance will be set to zero
+                     in the adjacency matrix.
+        """
+        if get_prim:
+            atoms = atoms.get_primitive_atoms
+        dim = [
+            max(1, int(np.ceil(enforce_c_size / lat)))
+            for lat in atoms.lattice.abc
+        ]
+        atoms = atoms.make_supercell(dim)
+
+        adj = np.array(atoms.raw_distance_matrix.copy())
+
+        # zero out edges with bond length greater than threshold
+        adj[adj >= max_cut] = 0
+
+        if zero_diag:
+            np.fill_diagonal(adj, 0.0)
+        nodes = np.arange(atoms.num_atoms)
+        node_attributes = np.array(
+            [
+                _get_node_attributes(s, atom_features=features)
+                for s in atoms.elements
+            ],
+            dtype="float",
+        )
+
+        adj = coo_matrix(adj)
+        edges = list(zip(adj.row, adj.col))
+        edge_attributes = list(adj.data)
+
+        return cls(
+            nodes=nodes,
+            edges=edges,
+            node_attributes=node_attributes,
+            edge_attributes=edge_attributes,
+        )
+
+    def to_networkx(self):
+        """Get networkx representation."""
+        import networkx as nx
+
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.nodes)
+        for (u, v), w in zip(self.edges, self.edge_attributes):
+            graph.add_edge(u, v, weight=w)
+        return graph
+
+    @staticmethod
+    def atom_dgl_multigraph(
+        atoms=None,
+        neighbor_strategy="k-nearest",
+        cutoff=8.0,
+        max_neighbors=12,
+        atom_features="cgcnn",
+        max_attempts=3,
+        id: Optional[str] = None,
+        compute_line_graph: bool = True,
+        use_canonize: bool = False,
+    ):
+        """Obtain a DGLGraph for Atoms object."""
+        try:
+            edge_builder = EDGE_STRATEGIES[neighbor_strategy]
+        except KeyError:
+            raise ValueError("Not implemented yet", neighbor_strategy)
+        edges = edge_builder(
+            atoms=atoms,
+            cutoff=cutoff,
+            max_neighbors=max_neighbors,
+            id=id,
+            use_canonize=use_canonize,
+        )
+
+        u, v, r = build_undirected_edgedata(atoms, edges)
+
+        # build up atom attribute tensor: featurize each distinct
+        # element once, then gather per-site rows from that matrix
+        unique_elements, site_ids = np.unique(
+            atoms.elements, return_inverse=True
+        )
+        features = np.array(
+            [
+                _get_node_attributes(s, atom_features=atom_features)
+                for s in unique_elements
+            ],
+            dtype="float",
+        )
+        node_features = torch.tensor(features[site_ids]).type(
+            torch.get_default_dtype()
+        )
+        g = dgl.graph((u, v))
+        g.ndata["atom_features"] = node_features
+        g.edata["r"] = r
+
+        if compute_line_graph:
+            # construct atomistic line graph
+            # (nodes are bonds, edges are bond pairs)
+            # and add bond angle cosines as edge features
+            lg = g.line_graph(shared=True)
+            lg.apply_edges(compute_bond_cosines)
+            return g, lg
+        else:
+            return g
+
+
+def dgl_crystal(
+    atoms,
+    primitive: bool = False,
+    cutoff: float = 8,
+    enforce_c_size: float = 5,
+    atom_features="atomic_number",
+):
+    """Get DGLGraph from atoms, go through Graph.from_atoms."""
+    jgraph = Graph.from_atoms(
+        atoms,
+        get_prim=primitive,
+        features=atom_features,
+        enforce_c_size=enforce_c_size,
+    )
+
+    # build the graph from the COO edge list directly, skipping the
+    # networkx round-trip and its per-edge attribute dictionaries
+    edges = np.asarray(jgraph.edges, dtype="int64").reshape(-1, 2)
+    g = dgl.graph(
+        (torch.from_numpy(edges[:, 0]), torch.from_numpy(edges[:, 1])),
+        num_nodes=len(jgraph.nodes),
+    )
+    g.edata["bondlength"] = torch.tensor(jgraph.edge_attributes).type(
+        torch.get_default_dtype()
+    )
+
+    g.ndata["atom_features"] = torch.tensor(jgraph.node_attributes).type(
+        torch.get_default_dtype()
+    )
+
+    return g
+
+
+def compute_bond_cosines(edges):
+    """Compute bond angle cosines from bond displacement vectors."""
+    # line graph edge: (a, b), (b, c)
+    # `a -> b -> c`
+    # use law of cosines to compute angles cosines
+    # negate src bond so displacements are like `a <- b -> c`
+    # cos(theta) = ba \dot bc / (||ba|| ||bc||)
+    r1 = -edges.src["r"]
+    r2 = edges.dst["r"]
+    bond_cosine = torch.sum(r1 * r2, dim=1) / (
+        torch.norm(r1, dim=1) * torch.norm(r2, dim=1)
+    )
+    bond_cosine = torch.clamp(bond_cosine, -1, 1)
+    return {"h": bond_cosine}
+
+
+class StructureDataset(torch.utils.data.Dataset):
+    """Dataset of crystal DGLGraphs."""
+
+    def __init__(
+        self,
+        df,
+        graphs,
+        target,
+        atom_features="atomic_number",
+        transform=None,
+        line_graph=False,
+        classification=False,
+        id_tag="jid",
+    ):
+        """Pytorch Dataset for atomistic graphs.
+
+        `df`: pandas dataframe from e.g. jarvis.db.figshare.data
+        `graphs`: DGLGraph representations corresponding to rows in `df`
+        `target`: key for label column in `df`
+        """
+        self.df = df
+        self.graphs = graphs
+        self.target = target
+        self.line_graph = line_graph
+
+        self.ids = self.df[id_tag]
+        self.labels = torch.tensor(self.df[target]).type(
+            torch.get_default_dtype()
+        )
+
+        self.transform = transform
+
+        features = self._get_attribute_lookup(atom_features)
+
+        # load selected node representation
+        # assume graphs contain atomic number in g.ndata["atom_features"]
+        for g in graphs:
+            z = g.ndata.pop("atom_features")
+            g.ndata["atomic_number"] = z
+            z = z.type(torch.IntTensor).squeeze()
+            f = torch.tensor(features[z]).type(torch.get_default_dtype())
+            if g.num_nodes() == 1:
+                f = f.unsqueeze(0)
+            g.ndata["atom_features"] = f
+
+        self.prepare_batch = prepare_dgl_batch
+        if line_graph:
+            self.prepare_batch = prepare_line_graph_batch
+
+            print("building line graphs")
+            self.line_graphs = []
+            for g in tqdm(graphs):
+                lg = g.line_graph(shared=True)
+                lg.apply_edges(compute_bond_cosines)
+                self.line_graphs.append(lg)
+
+        if classification:
+            self.labels = self.labels.view(-1).long()
+            print("Classification dataset.", self.labels)
+
+    @staticmethod
+    def _get_attribute_lookup(atom_features: str = "cgcnn"):
+        """Build a lookup array indexed by atomic number."""
+        max_z = max(v["Z"] for v in chem_data.values())
+
+        # get feature shape (referencing Carbon)
+        template = _get_node_attributes("C", atom_features)
+
+        features = np.zeros((1 + max_z, len(template)))
+
+        for element, v in chem_data.items():
+            z = v["Z"]
+            x = _get_node_attributes(element, atom_features)
+
+            if x is not None:
+                features[z, :] = x
+
+        return features
+
+    def __len__(self):
+        """Get length."""
+        return self.labels.shape[0]
+
+    def __getitem__(self, idx):
+        """Get StructureDataset sample."""
+        g = self.graphs[idx]
+        label = self.labels[idx]
+
+        if self.transform:
+            g = self.transform(g)
+
+        if self.line_graph:
+            return g, self.line_graphs[idx], label
+
+        return g, label
+
+    def setup_standardizer(self, ids):
+        """Atom-wise feature standardization transform."""
+        x = torch.cat(
+            [self.graphs[idx].ndata["atom_features"] for idx in ids]
+        )
+        self.atom_feature_mean = x.mean(0)
+        self.atom_feature_std = x.std(0)
+
+        self.transform = Standardize(
+            self.atom_feature_mean, self.atom_feature_std
+        )
+
+    @staticmethod
+    def collate(samples):
+        """Dataloader helper to batch graphs cross `samples`."""
+        graphs, labels = map(list, zip(*samples))
+        batched_graph = dgl.batch(graphs)
+        # labels are rows of the dataset label tensor already;
+        # stacking reuses them instead of re-copying through a list
+        return batched_graph, torch.stack(labels)
+
+    @staticmethod
+    def collate_line_graph(samples):
+        """Dataloader helper to batch graphs cross `samples`."""
+        graphs, line_graphs, labels = map(list, zip(*samples))
+        batched_graph = dgl.batch(graphs)
+        batched_line_graph = dgl.batch(line_graphs)
+        # torch.stack batches both scalar and multi-output labels
+        return batched_graph, batched_line_graph, torch.stack(labels)
+
+
+def prepare_dgl_batch(batch, device=None, non_blocking=False):
+    """Send batched dgl crystal graph to device."""
+    g, t = batch
+    batch = (
+        g.to(device, non_blocking=non_blocking),
+        t.to(device, non_blocking=non_blocking),
+    )
+
+    return batch
+
+
+def prepare_line_graph_batch(batch, device=None, non_blocking=False):
+    """Send batched dgl crystal graph to device.
+
+    Note: the batch is a nested tuple, with the graph and line graph
+    together.
+    """
+    g, lg, t = batch
+    batch = (
+        (
+            g.to(device, non_blocking=non_blocking),
+            lg.to(device, non_blocking=non_blocking),
+        ),
+        t.to(device, non_blocking=non_blocking),
+    )
+
+    return batch
+
+
+class Standardize(torch.nn.Module):
+    """Standardize atom_features: subtract mean and divide by std."""
+
+    def __init__(self, mean: torch.Tensor, std: torch.Tensor):
+        """Register featurewise mean and standard deviation."""
+        super().__init__()
+        self.mean = mean
+        self.std = std
+
+    def forward(self, g: dgl.DGLGraph):
+        """Apply standardization to atom_features."""
+        g = g.local_var()
+        # clone once, then shift and scale in place: avoids the two
+        # temporaries allocated by (h - mean) / std
+        h = g.ndata["atom_features"].clone()
+        g.ndata["atom_features"] = h.sub_(self.mean).div_(self.std)
+        return g
@@ -13,7 +13,7 @@ import sys
 # from jarvis.db.jsonutils import loadjson
 import argparse
 from jarvis.core.atoms import Atoms
-from jarvis.core.graphs import Graph
+from alignn.graphs import Graph
 from jarvis.db.jsonutils import dumpjson
 import pandas as pd
 
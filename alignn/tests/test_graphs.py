@@ -0,0 +1,128 @@
+"""Graph construction test suite."""
+import itertools
+
+import numpy as np
+import torch
+from jarvis.core.atoms import Atoms
+
+from alignn.graphs import build_undirected_edgedata, nearest_neighbor_edges
+
+
+# simple cubic Po: 18 neighbors within the 12th-neighbor distance
+cubic = Atoms(
+    lattice_mat=np.eye(3) * 3.35,
+    coords=[[0, 0, 0]],
+    elements=["Po"],
+)
+
+# rocksalt NaCl conventional cell: same 18-neighbor tie shell per site
+rocksalt = Atoms(
+    lattice_mat=np.eye(3) * 5.64,
+    coords=[
+        [0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5],
+        [0.5, 0.5, 0.5], [0, 0, 0.5], [0, 0.5, 0], [0.5, 0, 0],
+    ],
+    elements=["Na", "Na", "Na", "Na", "Cl", "Cl", "Cl", "Cl"],
+)
+
+# 1-atom hexagonal cell with a 25 A vacuum axis (dft_2d regime): the
+# in-plane shells need image shifts well beyond +-1
+hex_2d = Atoms(
+    lattice_mat=[
+        [2.5, 0, 0],
+        [-1.25, 2.1650635094610964, 0],
+        [0, 0, 25.0],
+    ],
+    coords=[[0, 0, 0]],
+    elements=["C"],
+)
+
+
+def brute_force_shells(atoms, max_neighbors=12, rad=10):
+    """Reference per-site neighbor shells from a large explicit supercell.
+
+    Returns, for each site, the sorted distances of every neighbor
+    within the k-th neighbor distance (ties included).
+    """
+    frac = np.asarray(atoms.frac_coords)
+    lat = np.asarray(atoms.lattice_mat)
+    shifts = np.array(
+        list(itertools.product(range(-rad, rad + 1), repeat=3))
+    )
+    shells = []
+    for f in frac:
+        disp = (frac[None, :, :] + shifts[:, None, :] - f) @ lat
+        d = np.linalg.norm(disp, axis=-1).ravel()
+        d = np.sort(d[d > 1e-8])
+        kth = d[max_neighbors - 1]
+        shells.append(d[d <= kth * (1 + 1e-8)])
+    return shells
+
+
+def edge_distances(atoms, src, dst, images):
+    """Cartesian length of each (src, dst, image) edge."""
+    frac = np.asarray(atoms.frac_coords)
+    lat = np.asarray(atoms.lattice_mat)
+    disp = (frac[dst] + images - frac[src]) @ lat
+    return np.linalg.norm(disp, axis=1)
+
+
+def canonical_edge_set(src, dst, images):
+    """Undirected edge set with src <= dst and the image flipped along."""
+    out = set()
+    for s, d, (i, j, k) in zip(src, dst, images):
+        if d < s:
+            s, d, i, j, k = d, s, -i, -j, -k
+        out.add((int(s), int(d), int(i), int(j), int(k)))
+    return out
+
+
+def test_nearest_neighbor_edges():
+    """Neighbor shells must match a brute-force supercell reference."""
+    for atoms in (cubic, rocksalt, hex_2d):
+        ref = brute_force_shells(atoms)
+        src, dst, images = nearest_neighbor_edges(
+            atoms=atoms, use_canonize=False
+        )
+        dists = edge_distances(atoms, src, dst, images)
+        for site, want in enumerate(ref):
+            mine = np.sort(dists[src == site])
+            assert len(mine) == len(want)
+            assert np.allclose(mine, want)
+
+
+def test_canonize_paths_agree():
+    """Canonical and plain edge lists describe the same undirected set."""
+    for atoms in (cubic, rocksalt, hex_2d):
+        src_c, dst_c, img_c = nearest_neighbor_edges(
+            atoms=atoms, use_canonize=True
+        )
+        src_p, dst_p, img_p = nearest_neighbor_edges(
+            atoms=atoms, use_canonize=False
+        )
+        assert np.all(src_c <= dst_c)
+        assert canonical_edge_set(src_c, dst_c, img_c) == canonical_edge_set(
+            src_p, dst_p, img_p
+        )
+
+
+def test_build_undirected_edgedata():
+    """Displacement vectors must be antisymmetric across directions."""
+    for atoms in (cubic, rocksalt, hex_2d):
+        edges = nearest_neighbor_edges(atoms=atoms, use_canonize=True)
+        u, v, r = build_undirected_edgedata(atoms=atoms, edges=edges)
+        n = len(edges[0])
+        assert len(u) == len(v) == len(r) == 2 * n
+        # second half is the reverse of the first
+        assert torch.equal(u[n:], v[:n])
+        assert torch.equal(v[n:], u[:n])
+        assert torch.allclose(r[n:], -r[:n])
+        assert r.dtype == torch.get_default_dtype()
+        # distinct bond lengths match the 12-neighbor shell reference
+        ref = np.unique(
+            np.round(np.concatenate(brute_force_shells(atoms)), 6)
+        )
+        lengths = np.unique(
+            np.round(torch.norm(r.double(), dim=1).numpy(), 6)
+        )
+        assert np.allclose(lengths, ref)
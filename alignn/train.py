@@ -175,6 +175,17 @@ def train_dgl(
         deterministic = True
         ignite.utils.manual_seed(config.random_seed)
 
+    # graph features, displacement vectors and model weights all go
+    # through torch.get_default_dtype(), so one switch downcasts the
+    # whole pipeline; fp16/bf16 only pay off on GPU targets
+    torch.set_default_dtype(
+        {
+            "float32": torch.float32,
+            "float16": torch.float16,
+            "bfloat16": torch.bfloat16,
+        }[config.dtype]
+    )
+
     line_graph = False
     alignn_models = {
         "alignn",
@@ -233,7 +244,11 @@ def train_dgl(
         val_loader = train_val_test_loaders[1]
         test_loader = train_val_test_loaders[2]
         prepare_batch = train_val_test_loaders[3]
-    prepare_batch = partial(prepare_batch, device=device)
+    # async H2D copies overlap with compute, but only pay off when the
+    # source batch lives in page-locked (pinned) host memory
+    prepare_batch = partial(
+        prepare_batch, device=device, non_blocking=config.pin_memory
+    )
     if classification:
         config.model.classification = True
     # define network, optimizer, scheduler